@@ -1,81 +1,138 @@
 import os
 import re
 import argparse
+from operator import itemgetter
+import shutil
+import subprocess
 import multiprocessing as mp
 from contextlib import redirect_stderr
-from multiprocessing.managers import ListProxy
 from io import BytesIO
 from zipfile import ZipFile, is_zipfile
-import _queue
 
 from svglib.svglib import svg2rlg
 from reportlab.graphics import renderPDF
+from reportlab.lib.pagesizes import A4
 
-from PyPDF2 import PdfMerger
-
-BLANK_PDF_PAGE = b'''%PDF-1.4
-1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj
-2 0 obj<</Type/Pages/Count 1/Kids[3 0 R]>>endobj
-3 0 obj<</Type/Page/MediaBox[0 0 595.276 841.890]/Parent 2 0 R/Resources<<>>>>endobj
-xref
-0 4
-0000000000 65535 f 
-0000000009 00000 n 
-0000000052 00000 n 
-0000000101 00000 n 
-trailer<</Size 4/Root 1 0 R>>
-startxref
-186
-%%EOF'''
-
-def convert_svg_to_pdf(svg_queue: mp.Queue, output_list: ListProxy, number_of_pages: int) -> None:
-    """Converts SVG data to PDF format and adds the results to the output list while there are tasks in the queue.
+from pypdf import PdfReader, PdfWriter
+
+BLANK_PAGE_SIZE = A4
+BACKENDS = ('svglib', 'rsvg')
+
+_zip_ref = None
+_page_compression = None
+
+
+def _init_worker(zip_path: str = None, compression: bool = True) -> None:
+    """Prepares a worker process. Used as the pool initializer.
+
+    Opens the zip archive once per worker process, since ZipFile handles cannot be passed between processes.
 
     Args:
-        svg_queue (mp.Queue): A queue containing tuples (page_number, svg_data).
-        output_list (Manager.ListProxy): A list to store the results as tuples (page_number, pdf_content).
-        number_of_pages (int): The total number of SVG files being processed.
+        zip_path (str, optional): The path to the zip archive containing SVG files. None for a directory.
+        compression (bool, optional): Whether the svglib backend zlib-compresses page streams. True keeps the
+            reportlab.rl_config.pageCompression default, False turns compression off. Defaults to True.
 
     Returns:
         None
+    """
+    global _zip_ref, _page_compression
+    if zip_path:
+        _zip_ref = ZipFile(zip_path, 'r')
+    _page_compression = None if compression else 0
+
+
+def _convert_one(item: tuple) -> tuple:
+    """Converts a single SVG page to PDF format. Used as the worker function of the conversion pool.
+
+    Args:
+        item (tuple): A tuple (index, page_number, svg_name), where index is the position of the page in the output PDF
+            and svg_name is a file path or, for a zip archive, a member name.
+
+    Returns:
+        tuple: A tuple (index, page_number, pdf_content).
 
     Raises:
-        Exception: If an error occurs during the conversion of SVG to PDF, a task with an empty pdf_content will be added to the resulting list.
-        _queue.Empty: Queue.get_nowait() sometimes throws an Empty exception. Read more this https://mail.python.org/pipermail/python-list/2002-July/150826.html
-        All exceptions of the Empty type are hidden.
+        Exception: If an error occurs during the conversion of SVG to PDF, None is returned as pdf_content.
     """
-    while svg_queue.qsize() > 0:
-        progress = f"Progress: {number_of_pages - svg_queue.qsize()}/{number_of_pages}"
-        print(progress, end='\r')
-    
-        try:
-            page_number, svg_data = svg_queue.get_nowait()
-        except _queue.Empty:
-            continue
-
-        try:
-            with redirect_stderr(None): #This context hides non-critical errors of svglib transformations
-                drawing = svg2rlg(BytesIO(svg_data))
-            pdf_content = renderPDF.drawToString(drawing)
-        except Exception as e:
-            print(f"Error converting SVG to PDF: {e}")
-            pdf_content = BLANK_PDF_PAGE
-        output_list.append((page_number, pdf_content))
-        print(" " * len(progress), end='\r')
+    index, page_number, svg_name = item
+    try:
+        with redirect_stderr(None): #This context hides non-critical errors of svglib transformations
+            if _zip_ref:
+                with _zip_ref.open(svg_name) as svg_file:
+                    drawing = svg2rlg(svg_file)
+            else:
+                drawing = svg2rlg(svg_name)
+        if drawing is None:  # svg2rlg returns None instead of raising for invalid XML
+            raise ValueError(f"{svg_name} is not a valid SVG file")
+        pdf_content = renderPDF.drawToString(drawing, pageCompression=_page_compression)
+    except Exception as e:
+        print(f"Error converting SVG to PDF: {e}")
+        pdf_content = None
+    return (index, page_number, pdf_content)
+
+
+def _convert_one_rsvg(item: tuple) -> tuple:
+    """Converts a single SVG page to PDF format with rsvg-convert. Used as the worker function of the conversion pool.
 
+    Args:
+        item (tuple): A tuple (index, page_number, svg_name), where index is the position of the page in the output PDF
+            and svg_name is a file path or, for a zip archive, a member name.
 
-def process_files(path_to_files:str, svg_queue: mp.Queue, pattern: str = None) -> (str, int):
+    Returns:
+        tuple: A tuple (index, page_number, pdf_content).
+
+    Raises:
+        Exception: If an error occurs during the conversion of SVG to PDF, None is returned as pdf_content.
+    """
+    index, page_number, svg_name = item
+    try:
+        if _zip_ref:
+            command, svg_data = ['rsvg-convert', '-f', 'pdf'], _zip_ref.read(svg_name)
+        else:
+            command, svg_data = ['rsvg-convert', '-f', 'pdf', svg_name], None
+        pdf_content = subprocess.run(command, input=svg_data, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+    except subprocess.CalledProcessError as e:
+        print(f"Error converting SVG {svg_name} to PDF: {e} {e.stderr.decode(errors='replace').strip()}")
+        pdf_content = None
+    except Exception as e:
+        print(f"Error converting SVG {svg_name} to PDF: {e}")
+        pdf_content = None
+    return (index, page_number, pdf_content)
+
+
+def _scan_svg_files(path: str):
     """
-    Reads SVG files in a directory or zip archive into RAM.
+    Recursively yields the SVG files of a directory without following symbolic links to directories.
+    Like os.walk, directories that cannot be listed are skipped silently.
 
-    This function takes the path to a directory or a zip archive containing SVG files,
-    reads the contents of each SVG file into memory, and adds the file data along with
-    its corresponding page number to a multiprocessing mp.Queue.
+    Args:
+        path (str): The path to the directory.
+
+    Yields:
+        tuple: The path and the name of each SVG file.
+    """
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_svg_files(entry.path)
+            elif entry.name.endswith(".svg"):
+                yield (entry.path, entry.name)
+
+
+def process_files(path_to_files:str, pattern: str = None) -> (str, str, list):
+    """
+    Lists SVG files in a directory or zip archive.
+
+    This function takes the path to a directory or a zip archive containing SVG files
+    and returns the name of each SVG file along with its corresponding page number, sorted by page number.
+    The files themselves are read later by the worker processes.
 
     Args:
         path_to_files (str): The path to the directory or zip archive containing SVG files.
-        svg_queue (mp.Queue): A multiprocessing mp.Queue used to store tuples
-            containing page number and SVG file data.
         pattern (str, optional): Regular expression pattern to extract page numbers from file names.
             Defaults to r'\\d+'.
 
@@ -83,89 +140,124 @@ def process_files(path_to_files:str, svg_queue: mp.Queue, pattern: str = None) -
         TypeError: Raised if the provided path is neither a directory nor a zip archive.
 
     Returns:
-        tuple: pdf filename and the total number of SVG files processed
+        tuple: pdf filename, the zip archive path (None for a directory) and a list of tuples (page_number, svg_name)
     """
     if not pattern:
         pattern = r'\d+'
 
     pattern = re.compile(pattern)
+    svg_files = []
 
-    def page_number(file_name:str, pattern: str) -> int:
+    def page_number(file_name:str) -> int:
         """
-        Extracts the page number from the file name using a regular expression pattern. The last match with the regular expression in the file name string is returned
+        Extracts the page number from the file name using the compiled pattern. The last match with the regular expression in the file name string is returned
 
         Args:
             file_name (str): The name of the SVG file.
-            pattern (str): A regular expression template for extracting page numbers.    
 
         Returns:
         int or str: The number of the extracted page.
         """
-        try:
-            page_number = int(re.findall(pattern, file_name)[-1])
-        except IndexError as e:
-            page_number = 0
-            print(f"Could not determine sequence number for file {file_name} with pattern {pattern.pattern}. The page will be placed at index 0 :")
-        return page_number
+        match = None
+        for match in pattern.finditer(file_name):
+            pass
+        if match:
+            return int(match.group(1 if pattern.groups else 0))
+        print(f"Could not determine sequence number for file {file_name} with pattern {pattern.pattern}. The page will be placed at index 0 :")
+        return 0
 
     if os.path.isdir(path_to_files):
         pdf_file_name = os.path.basename(path_to_files) + '.pdf'
-        for root, dirs, files in os.walk(path_to_files):
-            for file in files:
-                if file.endswith(".svg"):
-                    file_path = os.path.join(root, file)
-                    with open(file_path, 'rb') as svg_file:
-                        svg_data = svg_file.read()
-                        svg_queue.put((page_number(file, pattern), svg_data))
+        for file_path, file in _scan_svg_files(path_to_files):
+            svg_files.append((page_number(file), file_path))
+        zip_path = None
 
     elif is_zipfile(path_to_files):
         pdf_file_name = os.path.splitext(os.path.basename(path_to_files))[0] + '.pdf'
         with ZipFile(path_to_files, 'r') as zip_ref:
             for file in zip_ref.namelist():
                 if file.lower().endswith(".svg"):
-                    svg_queue.put((page_number(file, pattern), zip_ref.read(file)))
+                    svg_files.append((page_number(file), file))
+        zip_path = path_to_files
     else:
         raise TypeError("Directory or zip file is required.")
-    number_of_svg_files = svg_queue.qsize()
-    return (pdf_file_name, number_of_svg_files)
+    svg_files.sort(key=itemgetter(0))
+    return (pdf_file_name, zip_path, svg_files)
 
 
-def write_pdf(output_list, file_name='svg_to_pdf.pdf'):
+def _add_page(pdf: PdfWriter, page: bytes) -> None:
+    """
+    Appends the pages of a converted PDF to the output document.
+
+    Args:
+        pdf (PdfWriter): The output document.
+        page (bytes or None): The PDF content of the page. None adds a blank A4 page.
+
+    Returns:
+        None
+    """
+    if page is None:
+        pdf.add_blank_page(*BLANK_PAGE_SIZE)
+        return
+    try:
+        pdf_pages = PdfReader(BytesIO(page)).pages
+    except Exception:
+        pdf.add_blank_page(*BLANK_PAGE_SIZE)
+        raise
+    for pdf_page in pdf_pages:
+        pdf.add_page(pdf_page)
+
+
+def write_pdf(output, number_of_pages, file_name='svg_to_pdf.pdf'):
     """
-    Combines a list of SVG data into a single PDF file.
+    Combines converted pages into a single PDF file as they arrive.
 
-    This function takes a list of tuples containing page numbers and corresponding SVG data,
-    sorts them by page number, and merges the SVG data into a single PDF file using PyPDF2.
+    This function takes an iterable of tuples containing output indexes, page numbers and corresponding
+    PDF content in any order, and copies the pages into a single PDF file using pypdf. Pages that arrive
+    ahead of their turn wait in the slot of their output index until all preceding pages have been added,
+    so the document is assembled while the remaining pages are still being converted.
 
     Args:
-        output_list (list): List of tuples containing page number and SVG data.
+        output (iterable): Tuples containing output index, page number and PDF content.
+        number_of_pages (int): The total number of pages expected from output.
         file_name (str, optional): Name of the output PDF file. Defaults to 'svg_to_pdf.pdf'.
 
     Returns:
         None
     """
-    if output_list:
+    if number_of_pages:
         error_page = []
-        output_list.sort()
-        merger = PdfMerger()
-        for i, pdf in output_list:
-            try:
-                merger.append(BytesIO(pdf))
-                if pdf == BLANK_PDF_PAGE:
+        pending = [None] * number_of_pages
+        next_index = 0
+        progress_step = max(1, number_of_pages // 100)
+        pdf = PdfWriter()
+        for processed, result in enumerate(output, 1):
+            if processed % progress_step == 0:
+                progress = f"Progress: {processed}/{number_of_pages}"
+                print(progress, end='\r')
+            pending[result[0]] = result
+            while next_index < number_of_pages and pending[next_index] is not None:
+                _, i, page = pending[next_index]
+                pending[next_index] = None
+                try:
+                    _add_page(pdf, page)
+                    if page is None:
+                        error_page.append(i)
+                except Exception as e:
+                    print(f'Error PDF Writer in page {i}:{e}')
                     error_page.append(i)
-            except Exception as e:
-                print(f'Error PDF Merger in page {i}:{e}')
-                error_page.append(i)
-        merger.write(file_name)
-        merger.close()
+                next_index += 1
+        print(" " * len(progress), end='\r')
+        pdf.write(file_name)
+        pdf.close()
 
         if error_page:
-            print(f"File {file_name} was created with errors. Processed {len(output_list)} svg files pages. Of these, {len(error_page)} pages with numbers {error_page} have been replaced with blank A4 pages")
+            print(f"File {file_name} was created with errors. Processed {number_of_pages} svg files pages. Of these, {len(error_page)} pages with numbers {error_page} have been replaced with blank A4 pages")
         else:
-            print(f"File {file_name} was created successfully. Processed {len(output_list)} svg files")
+            print(f"File {file_name} was created successfully. Processed {number_of_pages} svg files")
 
 
-def main(path_to_svg:str = None, pattern_page_number: str = None):
+def main(path_to_svg:str = None, pattern_page_number: str = None, backend: str = None, compression: bool = None):
     """
     Main function to convert SVG files in a zip archive or directory to a single PDF file.
 
@@ -173,6 +265,8 @@ def main(path_to_svg:str = None, pattern_page_number: str = None):
         path_to_svg (str): Path to the directory or zip archive containing SVG files.
         pattern_page_number (str, optional): Regular expression pattern to extract page numbers from file names.
             Defaults to r'\\d+'.
+        backend (str, optional): The conversion backend, one of BACKENDS. Defaults to 'svglib'.
+        compression (bool, optional): Whether page streams of the svglib backend are zlib-compressed. Defaults to True.
 
     Returns:
         None
@@ -180,30 +274,38 @@ def main(path_to_svg:str = None, pattern_page_number: str = None):
     parser = argparse.ArgumentParser(description='Convert SVG files in a zip archive or directory to a single PDF file.')
     parser.add_argument('path_to_svg', help='Path to the directory or zip archive containing SVG files.')
     parser.add_argument('--pattern', default=r'\d+', help='Regular expression pattern to extract page numbers from file names. By default, the last group of digits in the file name "\\d+"')
+    parser.add_argument('--backend', choices=BACKENDS, default='svglib', help='Conversion backend. "rsvg" converts with the native rsvg-convert tool (librsvg) and merges the pages with pypdf; it falls back to "svglib" if rsvg-convert is not installed. By default, "svglib"')
+    parser.add_argument('--no-compression', action='store_true', help='Do not compress page streams with the svglib backend. Writes the PDF faster at the cost of a larger file.')
     args = parser.parse_args()
 
     if not path_to_svg:
         path_to_svg = args.path_to_svg
     if not pattern_page_number:
         pattern_page_number = args.pattern
+    if not backend:
+        backend = args.backend
+    if compression is None:
+        compression = not args.no_compression
+    if backend == 'rsvg' and not shutil.which('rsvg-convert'):
+        print("rsvg-convert was not found, falling back to the svglib backend")
+        backend = 'svglib'
+
+    pdf_file_name, zip_path, svg_files = process_files(path_to_svg, pattern_page_number)
+    number_of_svg_files = len(svg_files)
+    tasks = [(index, page, svg_name) for index, (page, svg_name) in enumerate(svg_files)]
 
-    mp_manager = mp.Manager()
-    svg_queue = mp.Queue()
-    output_list = mp_manager.list()
-
-    pdf_file_name, number_of_svg_files = process_files(path_to_svg, svg_queue, pattern_page_number)
-
-    processes = []
     number_of_CPUs = mp.cpu_count()
-    for _ in range(number_of_CPUs):
-        p = mp.Process(target=convert_svg_to_pdf, args=(svg_queue, output_list,number_of_svg_files))
-        processes.append(p)
-        p.start()
-
-    for p in processes:
-        p.join()
-
-    write_pdf(output_list, pdf_file_name)
+    chunksize = max(1, number_of_svg_files // (4 * number_of_CPUs))
+    convert = _convert_one_rsvg if backend == 'rsvg' else _convert_one
+    if 'forkserver' in mp.get_all_start_methods():
+        # Workers fork from a small server process that has imported this module (and with it svglib,
+        # reportlab and pypdf) once, instead of copying the parent's heap or importing them again in every worker.
+        mp_context = mp.get_context('forkserver')
+        mp_context.set_forkserver_preload(['__main__', 'svglib.svglib', 'reportlab.graphics.renderPDF'])
+    else:
+        mp_context = mp.get_context()
+    with mp_context.Pool(number_of_CPUs, initializer=_init_worker, initargs=(zip_path, compression)) as pool:
+        write_pdf(pool.imap_unordered(convert, tasks, chunksize=chunksize), number_of_svg_files, pdf_file_name)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file